@@ -2,7 +2,7 @@
 COD Verification System - Main Flask Application
 """
 
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, g, stream_with_context
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from functools import wraps
@@ -12,6 +12,16 @@ import os
 import jwt
 import csv
 import io
+import json
+import queue
+import time
+import threading
+import uuid
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from database import Database
 from shopify_api import MultiStoreManager
@@ -23,6 +33,37 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'default-secret-key')
 
+# Serialize jsonify/request.json through orjson when available; it is
+# several times faster than the stdlib encoder on the big list payloads
+# the Android app polls for
+if orjson is not None:
+    from flask.json.provider import JSONProvider
+
+    class OrjsonProvider(JSONProvider):
+        def dumps(self, obj, **kwargs):
+            # OPT_NON_STR_KEYS: stdlib json coerces int/None dict keys
+            # (e.g. stats grouped by assigned_to); stay drop-in compatible
+            return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = OrjsonProvider(app)
+
+# Server-side sessions in Redis when configured (shared across gunicorn
+# workers, and logins survive deploys); falls back to Flask's signed
+# cookie when REDIS_URL is not set
+if os.getenv('REDIS_URL'):
+    try:
+        import redis
+        from flask_session import Session
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis.from_url(os.getenv('REDIS_URL'))
+        Session(app)
+        print("✅ Redis session store configured")
+    except ImportError:
+        print("⚠️ REDIS_URL set but redis/flask-session not installed, using cookie sessions")
+
 # Initialize database
 db = Database()
 
@@ -75,7 +116,7 @@ def init_default_data():
             'Admin',
             'admin',
             email='admin@codverifier.com',
-            password_hash=generate_password_hash('admin123')
+            password_hash=generate_password_hash('admin123', method=PASSWORD_HASH_METHOD)
         )
         print("✅ Default admin created (email: admin@codverifier.com, password: admin123)")
     
@@ -90,8 +131,72 @@ def init_default_data():
             )
         print("✅ 5 default callers created (PINs: 1111, 2111, 3111, 4111, 5111)")
 
-# Initialize default data when module loads
-init_default_data()
+# Seed default data lazily on the first request instead of at import time,
+# so importing the module (gunicorn workers, scripts, tests) stays cheap.
+# The flag + lock make the seeding idempotent across threads.
+_default_data_ready = False
+_default_data_lock = threading.Lock()
+
+@app.before_request
+def ensure_default_data():
+    global _default_data_ready
+    if _default_data_ready:
+        return
+    with _default_data_lock:
+        if not _default_data_ready:
+            init_default_data()
+            _default_data_ready = True
+
+# Fixed hashing cost target. Werkzeug's default iteration count changes
+# between releases (and keeps climbing); pinning it keeps login latency
+# predictable and every stored hash comparable.
+PASSWORD_HASH_METHOD = 'pbkdf2:sha256:260000'
+
+# Status sets behind the /api/orders/by-status filter values; 'all' (or any
+# unknown value) applies no status predicate
+STATUS_FILTERS = {
+    'pending': ('pending',),
+    'confirmed': ('confirmed',),
+    'cancelled': ('cancelled',),
+    'retry': ('calling', 'assigned'),
+}
+
+# Call dispositions accepted by /api/orders/update-status,
+# pre-lowercased so validation is a single frozenset lookup
+VALID_STATUSES = frozenset([
+    'confirm on call', 'confirm on whatsapp call',
+    'confirm on text', 'confirm on whatsapp text',
+    'cancel on call', 'cancel on whatsapp call',
+    'cancel on whatsapp text', 'cancel on text',
+    'not received', 'line busy', 'call forwarded',
+    'incoming not available', 'call declined', 'language barrier',
+    'call not connected', 'seen no reply', 'undelivered',
+    'number not on whatsapp'
+])
+
+# ============= CACHING =============
+
+# Short-TTL memoization for cheap-to-stale aggregate reads.
+# Values are (expires_at, value) tuples keyed by name.
+_ttl_cache = {}
+
+def cache_get_or_load(key, ttl_seconds, loader):
+    """Return cached value for key, reloading via loader() after ttl_seconds"""
+    entry = _ttl_cache.get(key)
+    now = time.monotonic()
+    if entry and now < entry[0]:
+        return entry[1]
+    value = loader()
+    _ttl_cache[key] = (now + ttl_seconds, value)
+    return value
+
+def get_stores_cached():
+    """Store list for hot paths; stores change rarely so 30s staleness is fine"""
+    return cache_get_or_load('stores', 30, db.get_all_stores)
+
+def get_callers_cached():
+    """Caller list for hot paths, same trade-off as get_stores_cached"""
+    return cache_get_or_load('callers', 30, db.get_all_callers)
 
 # ============= AUTHENTICATION =============
 
@@ -104,6 +209,27 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def token_required(f):
+    """Decorator for the Android API: accept a JWT from /api/login
+
+    The token is verified statelessly (no user lookup per request); browser
+    sessions are accepted as a fallback so the endpoints stay usable from
+    the web UI.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        auth = request.headers.get('Authorization', '')
+        if auth.startswith('Bearer '):
+            try:
+                g.jwt_user = jwt.decode(auth[7:], app.secret_key, algorithms=['HS256'])
+                return f(*args, **kwargs)
+            except jwt.InvalidTokenError:
+                return jsonify({'error': 'Invalid or expired token'}), 401
+        if 'user_id' in session:
+            return f(*args, **kwargs)
+        return jsonify({'error': 'Authentication required'}), 401
+    return decorated_function
+
 def admin_required(f):
     """Decorator to require admin role"""
     @wraps(f)
@@ -195,10 +321,12 @@ def dashboard():
 @admin_required
 def store_assignment():
     """Store-to-caller assignment page"""
+    today = datetime.now().date()
+
     if request.method == 'POST':
         data = request.json
         assignments = data.get('assignments', [])
-        date = data.get('date', datetime.now().date())
+        date = data.get('date', today)
         
         # Clear existing assignments for this date
         # TODO: Add method to clear assignments
@@ -214,9 +342,9 @@ def store_assignment():
         return jsonify({'success': True})
     
     # GET request - show assignment form
-    stores = db.get_all_stores()
-    callers = db.get_all_callers()
-    today_assignments = db.get_assignments_for_date(datetime.now().date())
+    stores = get_stores_cached()
+    callers = get_callers_cached()
+    today_assignments = db.get_assignments_for_date(today)
     
     return render_template('store_assignment.html',
                          stores=stores,
@@ -240,6 +368,100 @@ def debug_shopify_config():
         })
     return jsonify(config)
 
+def run_fetch(source, days):
+    """Fetch and store orders from the given source, returning a summary dict"""
+    if source == 'shopify':
+        # Get excluded IDs (already confirmed/cancelled)
+        exclude_ids = db.get_confirmed_cancelled_ids()
+
+        # Fetch from all stores
+        all_orders = shopify_manager.fetch_all_stores(days, exclude_ids)
+
+        # Save to database
+        total_new = 0
+        stores_by_name = {s['name']: s for s in get_stores_cached()}
+        for store_name, orders in all_orders.items():
+            store = stores_by_name.get(store_name)
+
+            if not store:
+                continue
+
+            # Batch insert in one transaction (duplicates are skipped)
+            rows = [
+                (
+                    order['order_id'],
+                    store['id'],
+                    'cod',
+                    order['customer_name'],
+                    order['phone'],
+                    order['address'],
+                    order['pincode'],
+                    order['product_name'],
+                    order['price'],
+                    order['qty'],
+                    order['order_date']
+                )
+                for order in orders
+            ]
+            total_new += db.create_orders_bulk(rows)
+
+        # Auto-distribute to callers (nothing to assign when 0 new)
+        if total_new:
+            distribute_orders()
+
+        return {
+            'total_fetched': sum(len(orders) for orders in all_orders.values()),
+            'new_orders': total_new
+        }
+
+    elif source == 'abandoned_cart':
+        # Fetch abandoned carts from Shiprocket
+        carts = shiprocket_api.fetch_abandoned_carts(days)
+
+        if not carts:
+            return {
+                'total_fetched': 0,
+                'new_orders': 0,
+                'message': 'No abandoned carts found or endpoint not supported by Shiprocket'
+            }
+
+        # Save to database in one duplicate-safe batch
+        stores = get_stores_cached()
+
+        rows = []
+        for cart in carts:
+            # Try to match store by name, or use first store as default
+            store = next((s for s in stores if s['name'].lower() in cart.get('store', '').lower()), stores[0])
+
+            rows.append((
+                f"CART-{cart['cart_id']}",
+                store['id'],
+                'abandoned_cart',
+                cart['customer_name'],
+                cart['phone'],
+                cart['address'],
+                cart['pincode'],
+                cart['product_name'],
+                cart['total_price'],
+                cart['qty'],
+                cart['created_at']
+            ))
+
+        # Duplicates are skipped by the insert itself, and the
+        # affected-row count is the real number of new orders
+        total_new = db.create_orders_bulk(rows)
+
+        # Auto-distribute to callers (nothing to assign when 0 new)
+        if total_new:
+            distribute_orders()
+
+        return {
+            'total_fetched': len(carts),
+            'new_orders': total_new
+        }
+
+    return None
+
 @app.route('/fetch-orders', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -249,183 +471,127 @@ def fetch_orders():
         data = request.json
         source = data.get('source', 'shopify')  # 'shopify' or 'shiprocket'
         days = int(data.get('days', 10))
-        
-        if source == 'shopify':
-            # Get excluded IDs (already confirmed/cancelled)
-            exclude_ids = db.get_confirmed_cancelled_ids()
-            
-            # Fetch from all stores
-            all_orders = shopify_manager.fetch_all_stores(days, exclude_ids)
-            
-            # Save to database
-            total_new = 0
-            for store_name, orders in all_orders.items():
-                # Get store_id from database
-                stores = db.get_all_stores()
-                store = next((s for s in stores if s['name'] == store_name), None)
-                
-                if not store:
-                    continue
-                
-                for order in orders:
-                    try:
-                        db.create_order(
-                            order['order_id'],
-                            store['id'],
-                            'cod',
-                            order['customer_name'],
-                            order['phone'],
-                            order['address'],
-                            order['pincode'],
-                            order['product_name'],
-                            order['price'],
-                            order['qty'],
-                            order['order_date']
-                        )
-                        total_new += 1
-                    except Exception as e:
-                        # Skip duplicates
-                        continue
-            
-            # Auto-distribute to callers
-            distribute_orders()
-            
-            return jsonify({
-                'success': True,
-                'total_fetched': sum(len(orders) for orders in all_orders.values()),
-                'new_orders': total_new
-            })
-        
-        elif source == 'abandoned_cart':
-            # Fetch abandoned carts from Shiprocket
-            try:
-                carts = shiprocket_api.fetch_abandoned_carts(days)
-                
-                if not carts:
-                    return jsonify({
-                        'success': True,
-                        'total_fetched': 0,
-                        'new_orders': 0,
-                        'message': 'No abandoned carts found or endpoint not supported by Shiprocket'
-                    })
-                
-                # Save to database
-                total_new = 0
-                stores = db.get_all_stores()
-                
-                for cart in carts:
-                    try:
-                        # Try to match store by name, or use first store as default
-                        store = next((s for s in stores if s['name'].lower() in cart.get('store', '').lower()), stores[0])
-                        
-                        db.create_order(
-                            f"CART-{cart['cart_id']}",
-                            store['id'],
-                            'abandoned_cart',
-                            cart['customer_name'],
-                            cart['phone'],
-                            cart['address'],
-                            cart['pincode'],
-                            cart['product_name'],
-                            cart['total_price'],
-                            cart['qty'],
-                            cart['created_at']
-                        )
-                        total_new += 1
-                    except Exception as e:
-                        # Skip duplicates or errors
-                        continue
-                
-                # Auto-distribute to callers
-                distribute_orders()
-                
-                return jsonify({
-                    'success': True,
-                    'total_fetched': len(carts),
-                    'new_orders': total_new
-                })
-            except Exception as e:
-                return jsonify({
-                    'success': False,
-                    'error': str(e)
-                }), 500
-    
+
+        # Long fetches can run in the background so the request returns
+        # immediately; poll /api/fetch-status/<job_id> for the outcome.
+        # Job state lives in the fetch_jobs table so the poll can land on
+        # any gunicorn worker, not just the one running the thread
+        if data.get('background'):
+            job_id = uuid.uuid4().hex
+            db.create_fetch_job(job_id, source)
+
+            def worker():
+                try:
+                    result = run_fetch(source, days)
+                    db.finish_fetch_job(job_id, 'done', result=result)
+                except Exception as e:
+                    db.finish_fetch_job(job_id, 'failed', error=str(e))
+
+            threading.Thread(target=worker, daemon=True).start()
+            return jsonify({'success': True, 'job_id': job_id, 'status': 'running'}), 202
+
+        try:
+            result = run_fetch(source, days)
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
+
+        if result is not None:
+            return jsonify({'success': True, **result})
+
     return render_template('fetch_orders.html')
 
+@app.route('/api/fetch-status/<job_id>')
+@login_required
+@admin_required
+def fetch_status(job_id):
+    """Poll the state of a background fetch started via /fetch-orders"""
+    job = db.get_fetch_job(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job'}), 404
+    payload = {'status': job['status'], 'source': job['source']}
+    if job.get('result'):
+        payload['result'] = json.loads(job['result'])
+    if job.get('error'):
+        payload['error'] = job['error']
+    return jsonify(payload)
+
 def distribute_orders():
     """Auto-distribute pending orders to assigned callers"""
     today = datetime.now().date()
-    assignments = db.get_assignments_for_date(today)
-    
-    if not assignments:
-        return
-    
-    # Get all pending orders
-    pending_orders = db.get_orders_by_status('pending')
-    
-    if not pending_orders:
-        return
-    
-    # Group assignments by caller
-    caller_assignments = {}
-    for assignment in assignments:
-        caller_id = assignment['caller_id']
-        if caller_id not in caller_assignments:
-            caller_assignments[caller_id] = []
-        caller_assignments[caller_id].append(assignment['store_id'])
-    
-    # Distribute orders
-    for order in pending_orders:
-        # Find caller assigned to this order's store
-        for caller_id, store_ids in caller_assignments.items():
-            if order['store_id'] in store_ids:
-                db.assign_order(order['order_id'], caller_id)
-                break
+    return db.distribute_pending_orders(today)
 
 @app.route('/orders-list')
 @login_required
 @admin_required
 def orders_list():
-    """View all orders with filtering"""
+    """View all orders with filtering and pagination"""
     # Get filter parameters
     order_type = request.args.get('type', '')
     store_id = request.args.get('store', '')
     status = request.args.get('status', '')
-    
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    per_page = 100
+
     # Get all stores for dropdown
-    stores = db.get_all_stores()
+    stores = get_stores_cached()
     
     # Build query
-    query = '''
-        SELECT o.*, s.name as store_name, u.name as caller_name
-        FROM orders o
-        LEFT JOIN shopify_stores s ON o.store_id = s.id
-        LEFT JOIN users u ON o.assigned_to = u.id
-        WHERE 1=1
-    '''
+    # Build the WHERE clause from the non-empty filters only, always with
+    # bound parameters; project only the columns the template renders
+    conditions = []
     params = []
-    
+
     if order_type:
-        query += ' AND o.order_type = ?'
+        conditions.append('o.order_type = ?')
         params.append(order_type)
-    
+
     if store_id:
-        query += ' AND o.store_id = ?'
+        conditions.append('o.store_id = ?')
         params.append(int(store_id))
-    
+
     if status:
-        query += ' AND o.status = ?'
+        conditions.append('o.status = ?')
         params.append(status)
-    
-    query += ' ORDER BY o.created_at DESC LIMIT 500'
-    
+
+    where = (' WHERE ' + ' AND '.join(conditions)) if conditions else ''
+
+    count_query = 'SELECT COUNT(*) as cnt FROM orders o' + where
+    query = '''
+        SELECT o.order_id, o.order_type, o.customer_name, o.phone,
+               o.product_name, o.price, o.status,
+               s.name as store_name, u.name as caller_name
+        FROM orders o
+        LEFT JOIN shopify_stores s ON o.store_id = s.id
+        LEFT JOIN users u ON o.assigned_to = u.id
+    ''' + where + ' ORDER BY o.created_at DESC LIMIT ? OFFSET ?'
+
     with db.get_connection() as conn:
-        orders = conn.execute(query, params).fetchall()
-    
+        c = conn.cursor()
+        q, p = db.convert_query(count_query, tuple(params))
+        c.execute(q, p)
+        total_orders = c.fetchone()['cnt']
+        q, p = db.convert_query(query, tuple(params) + (per_page, (page - 1) * per_page))
+        c.execute(q, p)
+        orders = c.fetchall()
+
+    total_pages = max((total_orders + per_page - 1) // per_page, 1)
+
+    def page_url(target_page):
+        args = request.args.to_dict()
+        args['page'] = target_page
+        return url_for('orders_list', **args)
+
     return render_template('orders_list.html',
                          orders=orders,
                          stores=stores,
-                         total_orders=len(orders))
+                         total_orders=total_orders,
+                         page=page,
+                         total_pages=total_pages,
+                         prev_url=page_url(page - 1) if page > 1 else None,
+                         next_url=page_url(page + 1) if page < total_pages else None)
 
 @app.route('/upload-carts', methods=['GET', 'POST'])
 @login_required
@@ -445,37 +611,43 @@ def upload_carts():
         default_store_id = request.form.get('default_store')
         
         try:
-            # Read CSV file
-            stream = io.StringIO(file.stream.read().decode('utf-8'), newline=None)
+            # Decode the upload incrementally instead of buffering the whole
+            # file in memory before parsing
+            stream = io.TextIOWrapper(file.stream, encoding='utf-8', newline='')
             csv_reader = csv.DictReader(stream)
-            
-            # Parse rows
-            rows = list(csv_reader)
-            if not rows:
-                return jsonify({'success': False, 'error': 'CSV file is empty'}), 400
-            
+
             # Get stores for matching
-            stores = db.get_all_stores()
+            stores = get_stores_cached()
             default_store = stores[0] if stores else None
             if default_store_id:
                 default_store = next((s for s in stores if s['id'] == int(default_store_id)), default_store)
             
-            # Process each row
-            imported = 0
+            # Stream rows straight off the reader, then insert the batch in
+            # one duplicate-safe transaction
+            total_rows = 0
             skipped = 0
             preview_data = []
-            
-            for row in rows:
+            order_rows = []
+
+            # Lowercase the store names once for the whole file instead of
+            # per row inside parse_csv_row; same for the dateless-row
+            # fallback timestamp
+            lowered_stores = [(s['name'].lower(), s) for s in stores]
+            fallback_date = datetime.now().isoformat()
+
+            for row in csv_reader:
+                total_rows += 1
                 try:
                     # Parse row data (flexible column matching)
-                    order_data = parse_csv_row(row, default_store, stores)
-                    
+                    order_data = parse_csv_row(row, default_store, lowered_stores, fallback_date)
+
                     if not order_data:
                         skipped += 1
                         continue
-                    
-                    # Save to database
-                    db.create_order(
+
+                    if len(preview_data) < 10:
+                        preview_data.append(order_data)
+                    order_rows.append((
                         order_data['order_id'],
                         order_data['store_id'],
                         'abandoned_cart',
@@ -487,24 +659,30 @@ def upload_carts():
                         order_data['price'],
                         order_data['qty'],
                         order_data['order_date']
-                    )
-                    imported += 1
-                    preview_data.append(order_data)
-                    
+                    ))
+
                 except Exception as e:
-                    # Skip duplicates or invalid rows
+                    # Skip invalid rows
                     skipped += 1
                     continue
-            
-            # Auto-distribute to callers
-            distribute_orders()
-            
+
+            if not total_rows:
+                return jsonify({'success': False, 'error': 'CSV file is empty'}), 400
+
+            imported = db.create_orders_bulk(order_rows)
+            # Duplicates dropped by the insert count as skipped
+            skipped += len(order_rows) - imported
+
+            # Auto-distribute to callers (skip when nothing was imported)
+            if imported:
+                distribute_orders()
+
             return jsonify({
                 'success': True,
-                'total_rows': len(rows),
+                'total_rows': total_rows,
                 'imported': imported,
                 'skipped': skipped,
-                'preview': preview_data[:10]
+                'preview': preview_data
             })
             
         except Exception as e:
@@ -515,49 +693,76 @@ def upload_carts():
             }), 500
     
     # GET request - show upload form
-    stores = db.get_all_stores()
+    stores = get_stores_cached()
     return render_template('upload_carts.html', stores=stores)
 
-def parse_csv_row(row: dict, default_store: dict, all_stores: list) -> dict:
-    """Parse CSV row with flexible column matching"""
+# Column aliases tried (in order) for each field of the flexible CSV
+# import, compiled once instead of inline per row
+CSV_COLUMN_ALIASES = {
+    'order_id': ('order_id', 'id', 'order_number', 'cart_id', 'checkout_id'),
+    'customer_name': ('customer_name', 'name', 'customer', 'buyer_name'),
+    'phone': ('phone', 'mobile', 'contact', 'phone_number', 'customer_phone'),
+    'product_name': ('product', 'product_name', 'item', 'product_title', 'sku'),
+    'price': ('price', 'amount', 'total', 'total_price', 'value'),
+    'address': ('address', 'shipping_address', 'customer_address', 'delivery_address'),
+    'pincode': ('pincode', 'zip', 'postal_code', 'pin'),
+    'qty': ('qty', 'quantity', 'items', 'count'),
+    'store': ('store', 'store_name', 'channel', 'source'),
+    'order_date': ('date', 'created_at', 'order_date', 'timestamp'),
+}
+
+# Prices arrive like '1,299' or '₹1299 '; one translate pass strips the
+# currency sign and separators
+_PRICE_CLEAN = str.maketrans('', '', ',₹ ')
+
+def parse_csv_row(row: dict, default_store: dict, lowered_stores: list,
+                  fallback_date: str) -> dict:
+    """Parse CSV row with flexible column matching
+
+    lowered_stores: list of (lowercased_name, store) pairs, precomputed once
+    per upload so the per-row store match does no lowercasing.
+    fallback_date: ISO timestamp used when a row has no date column,
+    computed once per upload instead of per row.
+    """
     # Normalize column names (lowercase, remove spaces)
     normalized = {k.lower().strip().replace(' ', '_'): v for k, v in row.items()}
-    
-    # Find columns (try multiple possible names)
-    def get_value(*keys):
-        for key in keys:
+
+    # Find columns (try the precompiled alias list for the field)
+    def get_value(field):
+        for key in CSV_COLUMN_ALIASES[field]:
             if key in normalized and normalized[key]:
                 return normalized[key].strip()
         return ''
-    
+
     # Required fields
-    order_id = get_value('order_id', 'id', 'order_number', 'cart_id', 'checkout_id')
-    customer_name = get_value('customer_name', 'name', 'customer', 'buyer_name')
-    phone = get_value('phone', 'mobile', 'contact', 'phone_number', 'customer_phone')
-    product_name = get_value('product', 'product_name', 'item', 'product_title', 'sku')
-    price = get_value('price', 'amount', 'total', 'total_price', 'value')
-    
+    order_id = get_value('order_id')
+    customer_name = get_value('customer_name')
+    phone = get_value('phone')
+    product_name = get_value('product_name')
+    price = get_value('price')
+
     # Validate required fields
     if not order_id or not phone:
         return None
-    
+
     # Optional fields
-    address = get_value('address', 'shipping_address', 'customer_address', 'delivery_address')
-    pincode = get_value('pincode', 'zip', 'postal_code', 'pin')
-    qty = get_value('qty', 'quantity', 'items', 'count')
-    store_name = get_value('store', 'store_name', 'channel', 'source')
-    order_date = get_value('date', 'created_at', 'order_date', 'timestamp')
+    address = get_value('address')
+    pincode = get_value('pincode')
+    qty = get_value('qty')
+    store_name = get_value('store')
+    order_date = get_value('order_date')
     
     # Match store
     store = default_store
     if store_name:
-        matched = next((s for s in all_stores if s['name'].lower() in store_name.lower()), None)
+        store_name_lower = store_name.lower()
+        matched = next((s for lname, s in lowered_stores if lname in store_name_lower), None)
         if matched:
             store = matched
     
     # Parse numeric values
     try:
-        price = float(price.replace(',', '').replace('₹', '').strip()) if price else 0.0
+        price = float(price.translate(_PRICE_CLEAN)) if price else 0.0
     except:
         price = 0.0
     
@@ -576,7 +781,7 @@ def parse_csv_row(row: dict, default_store: dict, all_stores: list) -> dict:
         'product_name': product_name or 'Abandoned Cart',
         'price': price,
         'qty': qty,
-        'order_date': order_date or datetime.now().isoformat(),
+        'order_date': order_date or fallback_date,
         'store': store['name'] if store else 'Unknown'
     }
 
@@ -604,25 +809,9 @@ def caller_queue():
     """Caller's order queue (for Android app)"""
     caller_id = session.get('user_id')
     
-    # Get assigned orders
-    orders = db.get_orders_for_caller(caller_id)
-    
-    # Convert to JSON-friendly format
-    orders_list = []
-    for order in orders:
-        orders_list.append({
-            'id': order['id'],
-            'order_id': order['order_id'],
-            'customer_name': order['customer_name'],
-            'phone': order['phone'],
-            'address': order['address'],
-            'pincode': order['pincode'],
-            'product_name': order['product_name'],
-            'price': order['price'],
-            'qty': order['qty'],
-            'attempts': order['attempts']
-        })
-    
+    # Get assigned orders (already projected to the queue columns)
+    orders_list = [dict(order) for order in db.get_orders_for_caller(caller_id)]
+
     if request.is_json:
         return jsonify({'orders': orders_list})
     
@@ -631,82 +820,67 @@ def caller_queue():
 # ============= API ENDPOINTS =============
 
 @app.route('/api/orders/queue/<int:caller_id>')
+@token_required
 def api_get_queue(caller_id):
     """API: Get order queue for caller (for Android app)"""
-    orders = db.get_orders_for_caller(caller_id)
-    
-    orders_list = []
-    for order in orders:
-        orders_list.append({
-            'id': order['id'],
-            'order_id': order['order_id'],
-            'customer_name': order['customer_name'],
-            'phone': order['phone'],
-            'address': order['address'],
-            'pincode': order['pincode'],
-            'product_name': order['product_name'],
-            'price': order['price'],
-            'qty': order['qty'],
-            'attempts': order['attempts']
-        })
-    
-    return jsonify({'orders': orders_list})
+    def load_body():
+        orders_list = [dict(order) for order in db.get_orders_for_caller(caller_id)]
+        # Serialize once here; default=str covers timestamps coming out of
+        # the database without a per-field conversion pass
+        return json.dumps({'orders': orders_list}, default=str)
+
+    # Queue polling from the app is bursty; a couple of seconds of staleness
+    # is fine and update-status invalidates the entry anyway
+    body = cache_get_or_load(f'queue:{caller_id}', 2, load_body)
+    return app.response_class(body, mimetype='application/json')
 
 @app.route('/api/orders/by-status/<int:caller_id>')
+@token_required
 def api_get_orders_by_status(caller_id):
     """API: Get orders filtered by status for caller (for Status Dashboard)"""
     status_filter = request.args.get('status', 'all')
-    
-    # Build query based on status filter
+
+    # Build query from the status-set table, binding every status value.
+    # The projection matches the payload exactly (store_id is included for
+    # Shopify sync), so rows convert straight to dicts.
     query = '''
-        SELECT o.*, c.name as caller_name
+        SELECT o.id, o.order_id, o.customer_name, o.phone, o.address,
+               o.pincode, o.product_name, o.price, o.qty, o.status,
+               o.final_status, o.attempts, o.completed_at, o.updated_at,
+               o.store_id
         FROM orders o
-        LEFT JOIN users c ON o.assigned_to = c.id
         WHERE o.assigned_to = ?
     '''
     params = [caller_id]
-    
-    if status_filter == 'pending':
-        query += " AND o.status = 'pending'"
-    elif status_filter == 'confirmed':
-        query += " AND o.status = 'confirmed'"
-    elif status_filter == 'cancelled':
-        query += " AND o.status = 'cancelled'"
-    elif status_filter == 'retry':
-        query += " AND o.status IN ('calling', 'assigned')"
-    
+
+    statuses = STATUS_FILTERS.get(status_filter)
+    if statuses:
+        placeholders = ', '.join('?' * len(statuses))
+        query += f' AND o.status IN ({placeholders})'
+        params.extend(statuses)
+
     query += " ORDER BY o.updated_at DESC LIMIT 500"
-    
-    with db.get_connection() as conn:
-        orders = conn.execute(query, params).fetchall()
-    
-    orders_list = []
-    for order in orders:
-        orders_list.append({
-            'id': order['id'],
-            'order_id': order['order_id'],
-            'customer_name': order['customer_name'],
-            'phone': order['phone'],
-            'address': order['address'],
-            'pincode': order['pincode'],
-            'product_name': order['product_name'],
-            'price': order['price'],
-            'qty': order['qty'],
-            'status': order['status'],
-            'final_status': order['final_status'],
-            'attempts': order['attempts'],
-            'completed_at': order['completed_at'],
-            'updated_at': order['updated_at'],
-            'store_id': order.get('store_id')  # Include store_id for Shopify sync
-        })
-    
-    return jsonify({
-        'orders': orders_list,
-        'total': len(orders_list),
-        'filter': status_filter
-    })
+
+    def generate():
+        # Hand-rolled JSON framing: rows stream out as the cursor yields
+        # them instead of materializing a 500-dict list and encoding it
+        # in a second pass
+        yield '{"orders": ['
+        total = 0
+        with db.get_connection() as conn:
+            c = conn.cursor()
+            q, p = db.convert_query(query, tuple(params))
+            c.execute(q, p)
+            for order in c:
+                prefix = ', ' if total else ''
+                total += 1
+                yield prefix + json.dumps(dict(order), default=str)
+        yield f'], "total": {total}, "filter": {json.dumps(status_filter)}}}'
+
+    return app.response_class(stream_with_context(generate()), mimetype='application/json')
 
 @app.route('/api/orders/update-status', methods=['POST'])
+@token_required
 def api_update_status():
     """API: Update order status (called from Android app)"""
     data = request.json
@@ -719,65 +893,44 @@ def api_update_status():
     call_duration = data.get('call_duration', 0)
     
     # Validate status
-    valid_statuses = [
-        'confirm on call', 'confirm on whatsapp call', 
-        'confirm on text', 'confirm on whatsapp text',
-        'cancel on call', 'cancel on whatsapp call',
-        'cancel on whatsapp text', 'cancel on text',
-        'not received', 'line busy', 'call forwarded',
-        'incoming not available', 'call declined', 'language barrier',
-        'call not connected', 'seen no reply', 'undelivered',
-        'number not on whatsapp'
-    ]
-    
-    if status.lower() not in [s.lower() for s in valid_statuses]:
+    if status.lower() not in VALID_STATUSES:
         return jsonify({'error': 'Invalid status'}), 400
     
-    # Get order
-    order = db.get_order_by_id(order_id)
-    if not order:
-        return jsonify({'error': 'Order not found'}), 404
-    
-    # Increment attempts
-    db.increment_attempts(order_id)
-    
-    # Create call log (only if we have a database ID)
-    if order.get('id'):
-        try:
-            db.create_call_log(
-                order['id'],
-                caller_id,
-                order['phone'],
-                call_start,
-                call_end,
-                call_duration,
-                status
-            )
-        except Exception as e:
-            # Log the error but don't fail the request
-            print(f"Warning: Failed to create call log: {e}")
-    
-    # Update order status based on disposition
+    # Map disposition to the new order status and Shopify tag
     if 'confirm' in status.lower():
-        db.update_order_status(order_id, 'confirmed', status)
-        # Add Shopify tag: COD-Confirmed (skip if no store_id)
-        if order.get('store_id'):
-            add_shopify_tag_async(order_id, order['store_id'], 'COD-Confirmed')
+        new_status, tag = 'confirmed', 'COD-Confirmed'
     elif 'cancel' in status.lower():
-        db.update_order_status(order_id, 'cancelled', status)
-        # Add Shopify tag: COD-Cancelled (skip if no store_id)
-        if order.get('store_id'):
-            add_shopify_tag_async(order_id, order['store_id'], 'COD-Cancelled')
+        new_status, tag = 'cancelled', 'COD-Cancelled'
     else:
         # Retry status - put back in queue
-        db.update_order_status(order_id, 'assigned', status)
-        # Add Shopify tag: COD-Retry (skip if no store_id)
-        if order.get('store_id'):
-            add_shopify_tag_async(order_id, order['store_id'], 'COD-Retry')
-    
+        new_status, tag = 'assigned', 'COD-Retry'
+
+    # Fetch the order, bump attempts, log the call and set the status
+    # in a single transaction
+    order = db.record_call_result(
+        order_id, caller_id, new_status, status,
+        call_start, call_end, call_duration
+    )
+    if not order:
+        return jsonify({'error': 'Order not found'}), 404
+
+    # Drop the caller's cached queue body so they see the change immediately
+    _ttl_cache.pop(f'queue:{caller_id}', None)
+
+    # Queue the Shopify tag for the background worker (skip if no store_id)
+    if order.get('store_id'):
+        _shopify_queue.put((order_id, order['store_id'], tag))
+
     return jsonify({'success': True})
 
+# Deletes everything but digits in one C-level pass; used to count the
+# digits of a phone number without a per-character Python loop
+_NON_DIGITS = str.maketrans('', '', ''.join(
+    chr(i) for i in range(256) if not chr(i).isdigit()
+))
+
 @app.route('/api/orders/edit', methods=['POST'])
+@token_required
 def api_edit_order():
     """API: Edit order customer details (syncs to Shopify)"""
     data = request.json
@@ -806,7 +959,7 @@ def api_edit_order():
         pincode = pincode[:10]  # Truncate pincode
     
     # Basic phone validation (10-15 digits)
-    phone_digits = ''.join(filter(str.isdigit, phone))
+    phone_digits = phone.translate(_NON_DIGITS)
     if len(phone_digits) < 10 or len(phone_digits) > 15:
         return jsonify({
             'success': False,
@@ -846,7 +999,46 @@ def api_edit_order():
         'shopify_synced': shopify_synced
     })
 
-def sync_order_to_shopify(order_id: str, store_id: int, customer_name: str, 
+# Background queue of (order_id, store_id, tag) Shopify tag jobs. Tagging
+# an order costs a 300-800 ms REST round-trip that api_update_status
+# should not pay; a daemon worker drains the queue while the response
+# returns after the database write. Order edits stay synchronous because
+# the app shows the caller whether the Shopify sync succeeded.
+_shopify_queue = queue.Queue()
+
+def _shopify_worker():
+    while True:
+        batch = [_shopify_queue.get()]
+
+        # Coalesce a burst of updates: wait up to 250 ms (or 50 jobs) for
+        # more work so repeated tags on the same order collapse into one
+        # REST call instead of hammering Shopify's 2-req/s bucket
+        deadline = time.monotonic() + 0.25
+        while len(batch) < 50:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_shopify_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        grouped = {}
+        for order_id, store_id, tag in batch:
+            grouped.setdefault((order_id, store_id), {})[tag] = None
+
+        for (order_id, store_id), tags in grouped.items():
+            try:
+                add_shopify_tags(order_id, store_id, list(tags))
+            except Exception as e:
+                print(f"❌ Shopify background job failed: {e}")
+
+        for _ in batch:
+            _shopify_queue.task_done()
+
+threading.Thread(target=_shopify_worker, daemon=True).start()
+
+def sync_order_to_shopify(order_id: str, store_id: int, customer_name: str,
                           phone: str, address: str, pincode: str) -> bool:
     """Sync order edits to Shopify (with error handling)"""
     try:
@@ -857,12 +1049,7 @@ def sync_order_to_shopify(order_id: str, store_id: int, customer_name: str,
             return False
         
         # Find the Shopify API client for this store
-        shopify_api = None
-        for store_name, api in shopify_manager.stores.items():
-            if store_name == store['name']:
-                shopify_api = api
-                break
-        
+        shopify_api = shopify_manager.stores.get(store['name'])
         if not shopify_api:
             print(f"❌ Shopify API client not found for store {store['name']}")
             return False
@@ -888,30 +1075,25 @@ def sync_order_to_shopify(order_id: str, store_id: int, customer_name: str,
         print(f"❌ Shopify sync error for order {order_id}: {e}")
         return False
 
-def add_shopify_tag_async(order_id: str, store_id: int, tag: str):
-    """Add tag to Shopify order (async, logs errors but doesn't block)"""
+def add_shopify_tags(order_id: str, store_id: int, tags: list):
+    """Add tags to a Shopify order (runs on the background worker)"""
     try:
         # Get store details
         store = db.get_store_by_id(store_id)
         if not store:
             print(f"❌ Store not found for order {order_id}")
             return
-        
+
         # Find the Shopify API client for this store
-        shopify_api = None
-        for store_name, api in shopify_manager.stores.items():
-            if store_name == store['name']:
-                shopify_api = api
-                break
-        
+        shopify_api = shopify_manager.stores.get(store['name'])
         if not shopify_api:
             print(f"❌ Shopify API client not found for store {store['name']}")
             return
-        
-        # Add tag to order
-        shopify_api.add_order_tags(order_id, [tag])
-        print(f"✅ Added tag '{tag}' to order {order_id} on Shopify")
-        
+
+        # Add tags to order
+        shopify_api.add_order_tags(order_id, tags)
+        print(f"✅ Added tags {tags} to order {order_id} on Shopify")
+
     except Exception as e:
         print(f"❌ Failed to add tag to order {order_id}: {e}")
 
@@ -927,15 +1109,21 @@ def api_login():
     user = db.get_user_by_pin(pin)
     if not user:
         return jsonify({'error': 'Invalid PIN'}), 401
-    
-    # Generate JWT token
-    token = jwt.encode({
-        'user_id': user['id'],
-        'name': user['name'],
-        'role': user['role'],
-        'exp': datetime.utcnow() + timedelta(days=30)
-    }, app.secret_key, algorithm='HS256')
-    
+
+    # Tokens are valid for 30 days, so re-signing on every login is wasted
+    # HMAC work; reuse the same token for a while per user
+    def sign_token():
+        return jwt.encode({
+            'user_id': user['id'],
+            'name': user['name'],
+            'role': user['role'],
+            'exp': datetime.utcnow() + timedelta(days=30)
+        }, app.secret_key, algorithm='HS256')
+
+    # Key on the PIN, not user['id']: on the SQLite dev schema every id is
+    # NULL, which would hand all callers the first caller's token
+    token = cache_get_or_load(f"jwt:{pin}", 3600, sign_token)
+
     return jsonify({
         'success': True,
         'token': token,
@@ -949,8 +1137,10 @@ def api_login():
 # ============= RUN =============
 
 if __name__ == '__main__':
+    # Local development only; production runs under gunicorn (see
+    # gunicorn_conf.py)
     port = int(os.getenv('PORT', 5001))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    app.run(host='0.0.0.0', port=port, debug=os.getenv('FLASK_DEBUG') == '1')
 
 # ============= ADMIN UTILITY ROUTES =============
 
@@ -969,19 +1159,15 @@ def reassign_caller():
     try:
         with db.get_connection() as conn:
             c = conn.cursor()
-            
-            # Count orders to reassign
-            query = "SELECT COUNT(*) FROM orders WHERE assigned_to = ?"
-            c.execute(db.convert_query(query), (from_caller_id,))
-            count = c.fetchone()[0]
-            
-            # Reassign
+
+            # Reassign; the statement's own rowcount is the number moved,
+            # so no separate COUNT scan is needed
             query = "UPDATE orders SET assigned_to = ? WHERE assigned_to = ?"
             c.execute(db.convert_query(query), (to_caller_id, from_caller_id))
-            
+
             return jsonify({
                 'success': True,
-                'reassigned_count': count,
+                'reassigned_count': c.rowcount,
                 'from_caller': from_caller_id,
                 'to_caller': to_caller_id
             })
@@ -997,19 +1183,14 @@ def delete_all_orders():
     try:
         with db.get_connection() as conn:
             c = conn.cursor()
-            
-            # Count before delete
-            query = "SELECT COUNT(*) FROM orders"
-            c.execute(db.convert_query(query))
-            count = c.fetchone()[0]
-            
-            # Delete all orders
+
+            # Delete all orders; rowcount reports how many went
             query = "DELETE FROM orders"
             c.execute(db.convert_query(query))
-            
+
             return jsonify({
                 'success': True,
-                'deleted_count': count
+                'deleted_count': c.rowcount
             })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -1025,19 +1206,31 @@ def assign_all_to_caller():
     try:
         with db.get_connection() as conn:
             c = conn.cursor()
-            
-            # Count orders to assign
-            query = "SELECT COUNT(*) FROM orders"
-            c.execute(db.convert_query(query))
-            count = c.fetchone()[0] if db.is_postgres else c.fetchone()[0]
-            
-            # Assign all to specified caller
-            query = "UPDATE orders SET assigned_to = ?, status = 'assigned' WHERE 1=1"
-            c.execute(db.convert_query(query), (caller_id,))
-            
+
+            # Walk the table in bounded batches instead of one giant
+            # UPDATE, committing as we go: each statement touches at most
+            # 5000 rows, so row locks are held briefly and the planner
+            # never sees a table-sized write. Rows already assigned to
+            # this caller are left alone (and not counted).
+            query = db.convert_query('''
+                UPDATE orders SET assigned_to = ?, status = 'assigned'
+                WHERE order_id IN (
+                    SELECT order_id FROM orders
+                    WHERE assigned_to IS NULL OR assigned_to != ? OR status != 'assigned'
+                    LIMIT 5000
+                )
+            ''')
+            assigned = 0
+            while True:
+                c.execute(query, (caller_id, caller_id))
+                if c.rowcount <= 0:
+                    break
+                assigned += c.rowcount
+                conn.commit()
+
             return jsonify({
                 'success': True,
-                'assigned_count': count,
+                'assigned_count': assigned,
                 'caller_id': caller_id
             })
     except Exception as e:
@@ -1047,32 +1240,34 @@ def assign_all_to_caller():
 @login_required
 def database_stats():
     """Show database statistics for debugging"""
-    try:
+    def load_stats():
         with db.get_connection() as conn:
             c = conn.cursor()
-            
-            # Total orders
-            c.execute("SELECT COUNT(*) FROM orders")
-            total_orders = c.fetchone()[0]
-            
-            # Orders by status
-            c.execute("SELECT status, COUNT(*) FROM orders GROUP BY status")
-            status_counts = dict(c.fetchall())
-            
+
+            # Orders by status (the total falls out of the same scan)
+            c.execute("SELECT status, COUNT(*) as cnt FROM orders GROUP BY status")
+            status_counts = {row['status']: row['cnt'] for row in c.fetchall()}
+            total_orders = sum(status_counts.values())
+
             # Orders by assigned_to
-            c.execute("SELECT assigned_to, COUNT(*) FROM orders GROUP BY assigned_to")
-            assignment_counts = dict(c.fetchall())
-            
+            c.execute("SELECT assigned_to, COUNT(*) as cnt FROM orders GROUP BY assigned_to")
+            assignment_counts = {row['assigned_to']: row['cnt'] for row in c.fetchall()}
+
             # Sample orders
             c.execute("SELECT id, order_id, customer_name, status, assigned_to FROM orders LIMIT 5")
             sample_orders = [dict(row) for row in c.fetchall()]
-            
-            return jsonify({
+
+            return {
                 'total_orders': total_orders,
                 'by_status': status_counts,
                 'by_assignment': assignment_counts,
                 'sample_orders': sample_orders
-            })
+            }
+
+    try:
+        # Aggregate counts are expensive on large order tables; a few seconds
+        # of staleness is fine for a debug view
+        return jsonify(cache_get_or_load('database_stats', 10, load_stats))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
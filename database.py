@@ -3,20 +3,41 @@ COD Verification System - Database Module
 Supports both SQLite (local dev) and PostgreSQL (production)
 """
 
+import json
 import sqlite3
 import os
+import threading
 from datetime import datetime, timedelta
 from contextlib import contextmanager
+from functools import lru_cache
 
 try:
     import psycopg2
     import psycopg2.extras
+    import psycopg2.pool
     POSTGRES_AVAILABLE = True
 except ImportError:
     POSTGRES_AVAILABLE = False
 
 DB_FILE = "cod_verifier.db"
 
+@lru_cache(maxsize=256)
+def _translate_to_postgres(query):
+    """Rewrite SQLite-flavored SQL for PostgreSQL (cached per string)
+
+    The query set is finite — one literal per call site — so each string
+    pays the replace passes once instead of on every execution.
+    """
+    # Replace ? placeholders with %s for PostgreSQL
+    query = query.replace('?', '%s')
+
+    # Replace SQLite functions
+    query = query.replace("datetime('now')", "CURRENT_TIMESTAMP")
+    query = query.replace("AUTOINCREMENT", "")  # PostgreSQL uses SERIAL
+    query = query.replace("INTEGER PRIMARY KEY AUTOINCREMENT", "SERIAL PRIMARY KEY")
+
+    return query
+
 class Database:
     def __init__(self, db_path=None, database_url=None):
         self.db_path = db_path or DB_FILE
@@ -31,41 +52,70 @@ class Database:
             print(f"   Using PostgreSQL (Railway production)")
         else:
             print(f"   Using SQLite (local dev): {self.db_path}")
-        
+
+        # One long-lived SQLite connection per thread (see get_connection)
+        self._local = threading.local()
+
+        # PostgreSQL connections come from a pool: a fresh TCP+TLS+auth
+        # handshake per query dwarfs the queries themselves
+        self._pg_pool = None
+        if self.is_postgres:
+            self._pg_pool = psycopg2.pool.ThreadedConnectionPool(
+                1, int(os.getenv('DB_POOL_SIZE', 10)), self.database_url
+            )
+
         self.init_database()
-    
+
+    def _sqlite_connection(self):
+        """Get (or open) this thread's long-lived SQLite connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # The statement cache keeps hot queries compiled for the life of
+            # the connection; size it to hold the app's full query set
+            conn = sqlite3.connect(self.db_path, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            # WAL lets readers run alongside the writer, and NORMAL sync
+            # drops the per-commit fsync without risking corruption
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            # Keep sort/temp spill in RAM and give the page cache 64MB
+            # instead of the 2MB default
+            conn.execute('PRAGMA temp_store=MEMORY')
+            conn.execute('PRAGMA cache_size=-64000')
+            self._local.conn = conn
+        return conn
+
     @contextmanager
     def get_connection(self):
         """Context manager for database connections"""
         if self.is_postgres:
-            conn = psycopg2.connect(self.database_url)
+            conn = self._pg_pool.getconn()
             conn.cursor_factory = psycopg2.extras.RealDictCursor
+            try:
+                yield conn
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise e
+            finally:
+                # Hand the connection back instead of closing it; drop it
+                # from the pool if the server hung up mid-request
+                self._pg_pool.putconn(conn, close=conn.closed)
         else:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-        
-        try:
-            yield conn
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+            # Reuse the thread's connection instead of re-opening the file
+            # (and re-parsing the schema) on every query
+            conn = self._sqlite_connection()
+            try:
+                yield conn
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise e
     
     def convert_query(self, query, params=None):
         """Convert SQLite syntax to PostgreSQL when needed"""
-        if not self.is_postgres:
-            return (query, params) if params is not None else query
-        
-        # Replace ? placeholders with %s for PostgreSQL
-        query = query.replace('?', '%s')
-        
-        # Replace SQLite functions
-        query = query.replace("datetime('now')", "CURRENT_TIMESTAMP")
-        query = query.replace("AUTOINCREMENT", "")  # PostgreSQL uses SERIAL
-        query = query.replace("INTEGER PRIMARY KEY AUTOINCREMENT", "SERIAL PRIMARY KEY")
-        
+        if self.is_postgres:
+            query = _translate_to_postgres(query)
         return (query, params) if params is not None else query
     
     def init_database(self):
@@ -137,35 +187,32 @@ class Database:
             '''
             c.execute(self.convert_query(query))
             
-            # Add columns if they don't exist (migration for existing databases)
-            try:
-                c.execute('ALTER TABLE orders ADD COLUMN edited_customer_name TEXT')
-            except:
-                pass
-            try:
-                c.execute('ALTER TABLE orders ADD COLUMN edited_phone TEXT')
-            except:
-                pass
-            try:
-                c.execute('ALTER TABLE orders ADD COLUMN edited_address TEXT')
-            except:
-                pass
-            try:
-                c.execute('ALTER TABLE orders ADD COLUMN edited_pincode TEXT')
-            except:
-                pass
-            try:
-                c.execute('ALTER TABLE orders ADD COLUMN edited_at TIMESTAMP')
-            except:
-                pass
-            try:
-                c.execute('ALTER TABLE orders ADD COLUMN shopify_order_number TEXT')
-            except:
-                pass
-            try:
-                c.execute('ALTER TABLE orders ADD COLUMN shopify_synced_at TIMESTAMP')
-            except:
-                pass
+            # Add columns if they don't exist (migration for existing
+            # databases). Probe the catalog once and only ALTER what is
+            # missing: firing every ALTER and swallowing duplicate-column
+            # errors costs seven round-trips on startup and would poison
+            # the transaction on PostgreSQL
+            migration_columns = (
+                ('edited_customer_name', 'TEXT'),
+                ('edited_phone', 'TEXT'),
+                ('edited_address', 'TEXT'),
+                ('edited_pincode', 'TEXT'),
+                ('edited_at', 'TIMESTAMP'),
+                ('shopify_order_number', 'TEXT'),
+                ('shopify_synced_at', 'TIMESTAMP'),
+            )
+            if self.is_postgres:
+                c.execute('''
+                    SELECT column_name FROM information_schema.columns
+                    WHERE table_name = 'orders'
+                ''')
+                existing = {row['column_name'] for row in c.fetchall()}
+            else:
+                c.execute('PRAGMA table_info(orders)')
+                existing = {row['name'] for row in c.fetchall()}
+            for column, column_type in migration_columns:
+                if column not in existing:
+                    c.execute(f'ALTER TABLE orders ADD COLUMN {column} {column_type}')
             
             # Call logs
             query = '''
@@ -218,11 +265,41 @@ class Database:
                 )
             '''
             c.execute(self.convert_query(query))
-            
+
+            # Background fetch jobs. Kept in the database (not a process
+            # dict) so /api/fetch-status works no matter which gunicorn
+            # worker the poll lands on
+            query = '''
+                CREATE TABLE IF NOT EXISTS fetch_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    source TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            '''
+            c.execute(self.convert_query(query))
+
             # Create indexes for performance
             c.execute(self.convert_query('CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)'))
             c.execute(self.convert_query('CREATE INDEX IF NOT EXISTS idx_orders_assigned_to ON orders(assigned_to)'))
+            # Composite indexes covering the hot route predicates:
+            # orders_list filters store+status, distribution joins store on
+            # pending rows, and the list views sort recent-first
+            c.execute(self.convert_query('CREATE INDEX IF NOT EXISTS idx_orders_store_status ON orders(store_id, status)'))
+            c.execute(self.convert_query('CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(status, created_at)'))
+            # The status dashboard filters a caller's orders and sorts by
+            # last update
+            c.execute(self.convert_query('CREATE INDEX IF NOT EXISTS idx_orders_assigned_updated ON orders(assigned_to, updated_at)'))
+            # The caller queue filters assigned_to+status and sorts by
+            # created_at; this index satisfies both without a heap sort
+            c.execute(self.convert_query('CREATE INDEX IF NOT EXISTS idx_orders_caller_queue ON orders(assigned_to, status, created_at)'))
+            c.execute(self.convert_query('CREATE INDEX IF NOT EXISTS idx_orders_type_created ON orders(order_type, created_at)'))
             c.execute(self.convert_query('CREATE INDEX IF NOT EXISTS idx_orders_order_id ON orders(order_id)'))
+            # PIN login runs on every app open; a partial index over
+            # active users turns the lookup from a table scan into a probe
+            c.execute(self.convert_query('CREATE INDEX IF NOT EXISTS idx_users_pin_active ON users(pin) WHERE is_active = 1'))
             c.execute(self.convert_query('CREATE INDEX IF NOT EXISTS idx_call_logs_order_id ON call_logs(order_id)'))
             c.execute(self.convert_query('CREATE INDEX IF NOT EXISTS idx_call_logs_caller_id ON call_logs(caller_id)'))
             c.execute(self.convert_query('CREATE INDEX IF NOT EXISTS idx_assignments_date ON store_assignments(assigned_date)'))
@@ -303,6 +380,38 @@ class Database:
             c.execute(query, params)
             return c.lastrowid
     
+    def create_orders_bulk(self, orders):
+        """Insert many orders in one transaction, skipping duplicates
+
+        orders: list of (order_id, store_id, order_type, customer_name, phone,
+        address, pincode, product_name, price, qty, order_date) tuples.
+        Returns the number of rows actually inserted.
+        """
+        rows = list(orders)
+        if not rows:
+            return 0
+        with self.get_connection() as conn:
+            c = conn.cursor()
+            if self.is_postgres:
+                # execute_values folds the batch into one multi-row INSERT
+                # (one round-trip, one plan). page_size must cover the whole
+                # batch: with the default of 100 the insert is split into
+                # pages and rowcount would only reflect the last page
+                psycopg2.extras.execute_values(c, '''
+                    INSERT INTO orders (order_id, store_id, order_type, customer_name, phone,
+                                      address, pincode, product_name, price, qty, order_date)
+                    VALUES %s
+                    ON CONFLICT (order_id) DO NOTHING
+                ''', rows, page_size=len(rows))
+            else:
+                query = '''
+                    INSERT OR IGNORE INTO orders (order_id, store_id, order_type, customer_name, phone,
+                                      address, pincode, product_name, price, qty, order_date)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                '''
+                c.executemany(query, rows)
+            return max(c.rowcount, 0)
+
     def get_order_by_id(self, order_id):
         """Get order by order_id string"""
         with self.get_connection() as conn:
@@ -319,11 +428,13 @@ class Database:
             return c.fetchall()
     
     def get_orders_for_caller(self, caller_id, status='assigned'):
-        """Get orders assigned to a specific caller"""
+        """Get orders assigned to a specific caller (queue columns only)"""
         with self.get_connection() as conn:
             c = conn.cursor()
             query = '''
-                SELECT * FROM orders 
+                SELECT id, order_id, customer_name, phone, address, pincode,
+                       product_name, price, qty, attempts
+                FROM orders
                 WHERE assigned_to = ? AND status = ?
                 ORDER BY created_at ASC
             '''
@@ -335,23 +446,50 @@ class Database:
         """Assign an order to a caller"""
         with self.get_connection() as conn:
             c = conn.cursor()
+            now = datetime.now()
             c.execute('''
-                UPDATE orders 
+                UPDATE orders
                 SET assigned_to = ?, assigned_at = ?, status = 'assigned', updated_at = ?
                 WHERE order_id = ?
-            ''', (caller_id, datetime.now(), datetime.now(), order_id))
+            ''', (caller_id, now, now, order_id))
     
+    def distribute_pending_orders(self, date):
+        """Assign all pending orders to callers per the day's store assignments
+
+        One UPDATE ... FROM join against store_assignments replaces the
+        per-order Python scan. Stores with several callers assigned get the
+        lowest caller id. Returns the number of orders assigned.
+        """
+        with self.get_connection() as conn:
+            c = conn.cursor()
+            now = datetime.now()
+            query = '''
+                UPDATE orders
+                SET assigned_to = sa.caller_id, assigned_at = ?, status = 'assigned', updated_at = ?
+                FROM (
+                    SELECT store_id, MIN(caller_id) as caller_id
+                    FROM store_assignments
+                    WHERE assigned_date = ?
+                    GROUP BY store_id
+                ) sa
+                WHERE orders.store_id = sa.store_id AND orders.status = 'pending'
+            '''
+            query, params = self.convert_query(query, (now, now, date))
+            c.execute(query, params)
+            return max(c.rowcount, 0)
+
     def update_order_status(self, order_id, status, final_status=None):
         """Update order status"""
         with self.get_connection() as conn:
             c = conn.cursor()
+            now = datetime.now()
             if final_status:
                 query = '''
-                    UPDATE orders 
+                    UPDATE orders
                     SET status = ?, final_status = ?, updated_at = ?, completed_at = ?
                     WHERE order_id = ?
                 '''
-                query, params = self.convert_query(query, (status, final_status, datetime.now(), datetime.now(), order_id))
+                query, params = self.convert_query(query, (status, final_status, now, now, order_id))
                 c.execute(query, params)
             else:
                 query = '''
@@ -359,7 +497,7 @@ class Database:
                     SET status = ?, updated_at = ?
                     WHERE order_id = ?
                 '''
-                query, params = self.convert_query(query, (status, datetime.now(), order_id))
+                query, params = self.convert_query(query, (status, now, order_id))
                 c.execute(query, params)
     
     def increment_attempts(self, order_id):
@@ -374,22 +512,72 @@ class Database:
             query, params = self.convert_query(query, (datetime.now(), order_id))
             c.execute(query, params)
     
+    def record_call_result(self, order_id, caller_id, status, final_status,
+                          call_start, call_end, call_duration):
+        """Apply the outcome of a call in one transaction
+
+        Fetches the order, bumps attempts, sets the new status and logs the
+        call over a single connection instead of four separate ones.
+        Returns the order as a dict, or None if it does not exist.
+        """
+        with self.get_connection() as conn:
+            c = conn.cursor()
+            query, params = self.convert_query('SELECT * FROM orders WHERE order_id = ?', (order_id,))
+            c.execute(query, params)
+            order = c.fetchone()
+            if not order:
+                return None
+            order = dict(order)
+
+            now = datetime.now()
+            query = '''
+                UPDATE orders
+                SET attempts = attempts + 1, status = ?, final_status = ?,
+                    updated_at = ?, completed_at = ?
+                WHERE order_id = ?
+            '''
+            query, params = self.convert_query(query, (status, final_status, now, now, order_id))
+            c.execute(query, params)
+
+            if order.get('id'):
+                # Guard the insert with a savepoint: on PostgreSQL a failed
+                # statement poisons the whole transaction, which would turn
+                # the commit (and the status update above) into a rollback
+                c.execute('SAVEPOINT call_log')
+                try:
+                    query = '''
+                        INSERT INTO call_logs (order_id, caller_id, phone_dialed, call_start,
+                                             call_end, call_duration, status)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    '''
+                    query, params = self.convert_query(query, (order['id'], caller_id, order['phone'],
+                          call_start, call_end, call_duration, final_status))
+                    c.execute(query, params)
+                    c.execute('RELEASE SAVEPOINT call_log')
+                except Exception as e:
+                    # Log the error but don't fail the whole update
+                    c.execute('ROLLBACK TO SAVEPOINT call_log')
+                    print(f"Warning: Failed to create call log: {e}")
+
+            return order
+
     def update_order_edits(self, order_id, customer_name, phone, address, pincode, shopify_order_number=None):
         """Update order with edited details"""
         with self.get_connection() as conn:
             c = conn.cursor()
+            now = datetime.now()
             c.execute('''
-                UPDATE orders 
-                SET edited_customer_name = ?, 
-                    edited_phone = ?, 
-                    edited_address = ?, 
+                UPDATE orders
+                SET edited_customer_name = ?,
+                    edited_phone = ?,
+                    edited_address = ?,
                     edited_pincode = ?,
                     edited_at = ?,
                     shopify_order_number = COALESCE(?, shopify_order_number),
                     updated_at = ?
                 WHERE order_id = ?
-            ''', (customer_name, phone, address, pincode, datetime.now(), 
-                  shopify_order_number, datetime.now(), order_id))
+            ''', (customer_name, phone, address, pincode, now,
+                  shopify_order_number, now, order_id))
     
     def mark_shopify_synced(self, order_id):
         """Mark order as synced to Shopify"""
@@ -420,15 +608,15 @@ class Database:
         """Get all call logs for an order"""
         with self.get_connection() as conn:
             c = conn.cursor()
-            # First get internal ID
-            order = self.get_order_by_id(order_id)
-            if not order:
-                return []
-            c.execute('''
-                SELECT * FROM call_logs 
-                WHERE order_id = ?
-                ORDER BY created_at DESC
-            ''', (order['id'],))
+            # Resolve the internal id inside the query instead of a
+            # separate lookup round-trip
+            query, params = self.convert_query('''
+                SELECT cl.* FROM call_logs cl
+                JOIN orders o ON cl.order_id = o.id
+                WHERE o.order_id = ?
+                ORDER BY cl.created_at DESC
+            ''', (order_id,))
+            c.execute(query, params)
             return c.fetchall()
     
     def get_call_logs_for_caller(self, caller_id, limit=100):
@@ -481,43 +669,107 @@ class Database:
             ''', (caller_id, date))
             return c.fetchall()
     
+    # ============= FETCH JOBS =============
+
+    def create_fetch_job(self, job_id, source):
+        """Register a running background fetch, evicting day-old entries"""
+        with self.get_connection() as conn:
+            c = conn.cursor()
+            query, params = self.convert_query(
+                'DELETE FROM fetch_jobs WHERE created_at < ?',
+                (datetime.now() - timedelta(days=1),))
+            c.execute(query, params)
+            query, params = self.convert_query(
+                "INSERT INTO fetch_jobs (job_id, status, source) VALUES (?, 'running', ?)",
+                (job_id, source))
+            c.execute(query, params)
+
+    def finish_fetch_job(self, job_id, status, result=None, error=None):
+        """Record the outcome of a background fetch job"""
+        with self.get_connection() as conn:
+            c = conn.cursor()
+            query, params = self.convert_query(
+                'UPDATE fetch_jobs SET status = ?, result = ?, error = ? WHERE job_id = ?',
+                (status, json.dumps(result) if result is not None else None, error, job_id))
+            c.execute(query, params)
+
+    def get_fetch_job(self, job_id):
+        """Get one background fetch job's state as a dict, or None"""
+        with self.get_connection() as conn:
+            c = conn.cursor()
+            query, params = self.convert_query(
+                'SELECT * FROM fetch_jobs WHERE job_id = ?', (job_id,))
+            c.execute(query, params)
+            row = c.fetchone()
+            return dict(row) if row else None
+
     # ============= STATS & REPORTS =============
     
+    # The status column is constrained to five values, so the old
+    # LIKE '%confirm%' pattern matches are just equality tests in
+    # disguise; FILTER with direct comparisons counts each bucket
+    # without a per-row pattern scan
+    _STATS_AGGREGATES = '''
+        COUNT(*) as total_calls,
+        COUNT(*) FILTER (WHERE status = 'confirmed') as confirmed,
+        COUNT(*) FILTER (WHERE status = 'cancelled') as cancelled,
+        COUNT(*) FILTER (WHERE status NOT IN ('confirmed', 'cancelled')) as pending
+    '''
+
     def get_stats_for_caller(self, caller_id, date=None):
         """Get stats for a caller (optionally for a specific date)"""
         with self.get_connection() as conn:
             c = conn.cursor()
+            query = f'''
+                SELECT {self._STATS_AGGREGATES}
+                FROM orders
+                WHERE assigned_to = ?
+            '''
+            params = [caller_id]
             if date:
-                c.execute('''
-                    SELECT 
-                        COUNT(*) as total_calls,
-                        SUM(CASE WHEN status LIKE '%confirm%' THEN 1 ELSE 0 END) as confirmed,
-                        SUM(CASE WHEN status LIKE '%cancel%' THEN 1 ELSE 0 END) as cancelled,
-                        SUM(CASE WHEN status NOT LIKE '%confirm%' AND status NOT LIKE '%cancel%' THEN 1 ELSE 0 END) as pending
-                    FROM orders
-                    WHERE assigned_to = ? AND DATE(updated_at) = ?
-                ''', (caller_id, date))
-            else:
-                c.execute('''
-                    SELECT 
-                        COUNT(*) as total_calls,
-                        SUM(CASE WHEN status LIKE '%confirm%' THEN 1 ELSE 0 END) as confirmed,
-                        SUM(CASE WHEN status LIKE '%cancel%' THEN 1 ELSE 0 END) as cancelled,
-                        SUM(CASE WHEN status NOT LIKE '%confirm%' AND status NOT LIKE '%cancel%' THEN 1 ELSE 0 END) as pending
-                    FROM orders
-                    WHERE assigned_to = ?
-                ''', (caller_id,))
+                query += ' AND DATE(updated_at) = ?'
+                params.append(date)
+            query, params = self.convert_query(query, tuple(params))
+            c.execute(query, params)
             return c.fetchone()
     
-    def get_confirmed_cancelled_ids(self):
-        """Get list of order IDs that are confirmed or cancelled"""
+    def get_stats_for_all_callers(self, date=None):
+        """Get stats for every caller in one grouped query"""
         with self.get_connection() as conn:
             c = conn.cursor()
+            query = f'''
+                SELECT
+                    assigned_to as caller_id,
+                    {self._STATS_AGGREGATES}
+                FROM orders
+                WHERE assigned_to IS NOT NULL
+            '''
+            if date:
+                query += ' AND DATE(updated_at) = ?'
+                query += ' GROUP BY assigned_to'
+                query, params = self.convert_query(query, (date,))
+                c.execute(query, params)
+            else:
+                query += ' GROUP BY assigned_to'
+                c.execute(self.convert_query(query))
+            return c.fetchall()
+
+    def get_confirmed_cancelled_ids(self):
+        """Get order IDs that are confirmed or cancelled, as a frozenset"""
+        with self.get_connection() as conn:
+            # Single-column projection: a plain tuple cursor skips the
+            # per-row dict that RealDictCursor would build and throw away
+            if self.is_postgres:
+                c = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+            else:
+                c = conn.cursor()
             c.execute('''
-                SELECT order_id FROM orders 
+                SELECT order_id FROM orders
                 WHERE status IN ('confirmed', 'cancelled')
             ''')
-            return [row['order_id'] for row in c.fetchall()]
+            # Callers use this purely for membership tests against fetched
+            # Shopify orders, so hand back a set rather than a list
+            return frozenset(row[0] for row in c.fetchall())
 
 
 # Initialize database on import
@@ -0,0 +1,21 @@
+"""
+Gunicorn configuration for production deploys (Railway / Procfile)
+"""
+
+import multiprocessing
+
+# One process per core so CPU-heavy work (CSV parsing, JSON encoding,
+# Jinja rendering) runs in parallel instead of serializing on one GIL;
+# gthread workers keep the IO-bound Shopify/Shiprocket calls from tying
+# up a whole process
+workers = multiprocessing.cpu_count()
+threads = 4
+worker_class = 'gthread'
+
+# Keep the default (no preload): app startup spawns daemon threads (the
+# Shopify tag worker) that would not survive a fork from a preloaded
+# master, so each worker must import the app itself
+preload_app = False
+
+# Shopify fetches can take a while on large date ranges
+timeout = 120
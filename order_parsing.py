@@ -0,0 +1,32 @@
+"""
+COD Verification System - Shared payload parsing helpers
+Common field extraction used by the Shopify and Shiprocket clients
+"""
+
+from operator import itemgetter
+from typing import Dict, List
+
+_get_quantity = itemgetter('quantity')
+
+
+def join_address(parts: List, default: str = 'No address provided') -> str:
+    """Join the non-empty address parts into one comma-separated line"""
+    return ', '.join([p for p in parts if p]) or default
+
+
+def full_name(source: Dict) -> str:
+    """Build "first last" from a customer/address dict ('' when empty)"""
+    return f"{source.get('first_name', '')} {source.get('last_name', '')}".strip()
+
+
+def total_quantity(items: List, default: int = 0) -> int:
+    """Sum line-item quantities, accepting either quantity or qty keys"""
+    try:
+        # Fast path: every item carries a numeric 'quantity' (Shopify)
+        total = sum(map(_get_quantity, items))
+    except (KeyError, TypeError):
+        # Mixed/odd payloads (Shiprocket 'qty', missing or null values)
+        total = 0
+        for item in items:
+            total += item.get('quantity', 0) or item.get('qty', 0)
+    return total or default
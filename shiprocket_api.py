@@ -3,40 +3,108 @@ Shiprocket API Integration for COD Verification System
 Handles: Authentication, Abandoned Cart Fetching
 """
 
+import json
+import random
 import requests
 import time
 from datetime import datetime, timedelta
 from typing import Dict, List
 
+from order_parsing import join_address, full_name, total_quantity
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Shared session so keep-alive connections to apiv2.shiprocket.in are
+# reused instead of paying a TLS handshake per call
+_session = requests.Session()
+_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=10))
+
+def _decode_json(response):
+    """Decode a response body, preferring orjson's C parser"""
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+# Shared read-only fallback for missing sub-dicts, so the parse loop
+# doesn't allocate a fresh {} per cart per field. Never mutate.
+_EMPTY = {}
+
 class ShiprocketAPI:
     BASE_URL = "https://apiv2.shiprocket.in/v1/external"
-    
+    # Tokens live for ~9 days; cache one on disk so restarts don't pay
+    # the login round-trip
+    TOKEN_CACHE_FILE = ".shiprocket_token.json"
+    # Which abandoned-carts endpoint actually worked last time; the
+    # account's API surface doesn't change between calls, so once found
+    # we try it first instead of probing all candidates again
+    _working_endpoint = None
+
     def __init__(self, email: str, password: str):
         self.email = email
         self.password = password
         self.token = None
         self.token_expiry = None
-    
+        self._cached_headers = None
+        self._load_token()
+
+    def _load_token(self):
+        """Reuse a previously saved token if it is still valid"""
+        try:
+            with open(self.TOKEN_CACHE_FILE) as f:
+                data = json.load(f)
+            if data.get('email') != self.email:
+                return
+            expiry = datetime.fromisoformat(data['token_expiry'])
+            if datetime.now() >= expiry:
+                return
+            self.token = data['token']
+            self.token_expiry = expiry
+            self._cached_headers = {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {self.token}"
+            }
+        except (OSError, ValueError, KeyError):
+            # Missing or stale cache file; authenticate() will run on the
+            # first request
+            pass
+
+    def _save_token(self):
+        """Persist the current token for the next process"""
+        try:
+            with open(self.TOKEN_CACHE_FILE, 'w') as f:
+                json.dump({
+                    'email': self.email,
+                    'token': self.token,
+                    'token_expiry': self.token_expiry.isoformat()
+                }, f)
+        except OSError as e:
+            print(f"⚠️ Could not persist Shiprocket token: {e}")
+
     def _get_headers(self) -> Dict[str, str]:
-        """Get headers with auth token"""
+        """Get headers with auth token (rebuilt only on re-auth)"""
         if not self.token or (self.token_expiry and datetime.now() >= self.token_expiry):
             self.authenticate()
-        return {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.token}"
-        }
-    
+        return self._cached_headers
+
     def authenticate(self) -> bool:
         """Authenticate and get token"""
         url = f"{self.BASE_URL}/auth/login"
         payload = {"email": self.email, "password": self.password}
-        
+
         try:
-            response = requests.post(url, json=payload, timeout=30)
+            response = _session.post(url, json=payload, timeout=30)
             if response.status_code == 200:
-                data = response.json()
+                data = _decode_json(response)
                 self.token = data.get("token")
                 self.token_expiry = datetime.now() + timedelta(days=9)
+                self._cached_headers = {
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {self.token}"
+                }
+                self._save_token()
                 print(f"✅ Shiprocket authenticated successfully")
                 return True
             else:
@@ -54,23 +122,26 @@ class ShiprocketAPI:
                 headers = self._get_headers()
                 
                 if method == "GET":
-                    response = requests.get(url, headers=headers, params=params, timeout=30)
+                    response = _session.get(url, headers=headers, params=params, timeout=30)
                 elif method == "POST":
-                    response = requests.post(url, headers=headers, json=params, timeout=30)
+                    response = _session.post(url, headers=headers, json=params, timeout=30)
                 else:
                     raise ValueError(f"Unsupported method: {method}")
                 
                 if response.status_code == 200:
-                    return response.json()
+                    return _decode_json(response)
                 elif response.status_code == 401:
                     # Token expired, re-authenticate
                     self.token = None
                     self.authenticate()
                     continue
                 elif response.status_code == 429:
-                    # Rate limited
-                    wait_time = (attempt + 1) * 2
-                    print(f"⏳ Rate limited. Waiting {wait_time}s...")
+                    # Rate limited: honor Retry-After if sent, otherwise
+                    # back off exponentially with jitter to avoid
+                    # re-entering in lockstep
+                    retry_after = response.headers.get('Retry-After')
+                    wait_time = float(retry_after) if retry_after else (2 ** attempt) + random.uniform(0, 1)
+                    print(f"⏳ Rate limited. Waiting {wait_time:.1f}s...")
                     time.sleep(wait_time)
                     continue
                 else:
@@ -79,7 +150,7 @@ class ShiprocketAPI:
             except Exception as e:
                 print(f"❌ Request error (attempt {attempt + 1}): {e}")
                 if attempt < retries - 1:
-                    time.sleep(2)
+                    time.sleep((2 ** attempt) + random.uniform(0, 1))
                     continue
                 return None
         
@@ -96,8 +167,9 @@ class ShiprocketAPI:
         
         We'll start with the most common pattern and log errors for debugging
         """
-        start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-        end_date = datetime.now().strftime('%Y-%m-%d')
+        now = datetime.now()
+        start_date = (now - timedelta(days=days)).strftime('%Y-%m-%d')
+        end_date = now.strftime('%Y-%m-%d')
         
         print(f"📥 Attempting to fetch abandoned carts from Shiprocket ({start_date} to {end_date})...")
         
@@ -108,28 +180,34 @@ class ShiprocketAPI:
             ('cart_recovery', {'start_date': start_date, 'end_date': end_date}),
             ('orders', {'created_from': start_date, 'created_to': end_date, 'status': 'abandoned'}),
         ]
-        
+
+        # Put the endpoint that worked last time first; the rest stay as
+        # fallbacks in case the account's API surface changes
+        if ShiprocketAPI._working_endpoint:
+            endpoints_to_try.sort(key=lambda e: e[0] != ShiprocketAPI._working_endpoint)
+
         for endpoint, params in endpoints_to_try:
             print(f"🔍 Trying endpoint: /{endpoint}")
             result = self._request('GET', endpoint, params=params)
             
             if result and isinstance(result, dict):
                 # Check for common response structures
+                carts = None
                 if 'data' in result and result['data']:
-                    print(f"✅ Found {len(result['data'])} abandoned carts from /{endpoint}")
-                    return self._parse_carts(result['data'])
+                    carts = result['data']
                 elif 'checkouts' in result and result['checkouts']:
-                    print(f"✅ Found {len(result['checkouts'])} abandoned carts from /{endpoint}")
-                    return self._parse_carts(result['checkouts'])
+                    carts = result['checkouts']
                 elif 'carts' in result and result['carts']:
-                    print(f"✅ Found {len(result['carts'])} abandoned carts from /{endpoint}")
-                    return self._parse_carts(result['carts'])
+                    carts = result['carts']
                 elif 'orders' in result and result['orders']:
                     # Filter for abandoned status
-                    abandoned = [o for o in result['orders'] if o.get('status') == 'abandoned']
-                    if abandoned:
-                        print(f"✅ Found {len(abandoned)} abandoned carts from /{endpoint}")
-                        return self._parse_carts(abandoned)
+                    carts = [o for o in result['orders'] if o.get('status') == 'abandoned'] or None
+
+                if carts:
+                    # Remember the winner so the next call skips the probe
+                    ShiprocketAPI._working_endpoint = endpoint
+                    print(f"✅ Found {len(carts)} abandoned carts from /{endpoint}")
+                    return self._parse_carts(carts)
                 else:
                     print(f"⚠️ Endpoint /{endpoint} returned data but no recognizable cart structure")
             else:
@@ -146,17 +224,25 @@ class ShiprocketAPI:
         
         for cart in carts:
             try:
+                # Pull the shared sub-dicts once per cart; the field
+                # helpers used to re-fetch each of these several times
+                customer = cart.get('customer') or _EMPTY
+                billing = cart.get('billing_address') or _EMPTY
+                shipping = cart.get('shipping_address') or _EMPTY
+                address_source = shipping or billing
+                items = cart.get('line_items', []) or cart.get('products', []) or cart.get('items', [])
+
                 # Try to extract common fields (structure may vary)
                 parsed_cart = {
                     'cart_id': cart.get('id') or cart.get('checkout_id') or cart.get('cart_token'),
-                    'customer_name': self._get_customer_name(cart),
-                    'phone': self._get_phone(cart),
-                    'email': cart.get('email') or cart.get('customer', {}).get('email'),
-                    'address': self._get_address(cart),
-                    'pincode': self._get_pincode(cart),
-                    'product_name': self._get_product_name(cart),
+                    'customer_name': self._get_customer_name(cart, customer, billing),
+                    'phone': self._get_phone(cart, customer, billing, shipping),
+                    'email': cart.get('email') or customer.get('email'),
+                    'address': self._get_address(address_source),
+                    'pincode': self._get_pincode(address_source),
+                    'product_name': self._get_product_name(items),
                     'total_price': float(cart.get('total_price', 0) or cart.get('amount', 0) or 0),
-                    'qty': self._get_total_qty(cart),
+                    'qty': self._get_total_qty(items),
                     'created_at': cart.get('created_at') or cart.get('abandoned_at'),
                     'store': cart.get('channel_name') or cart.get('store_name') or 'Unknown'
                 }
@@ -170,84 +256,59 @@ class ShiprocketAPI:
         
         return parsed
     
-    def _get_customer_name(self, cart: Dict) -> str:
+    def _get_customer_name(self, cart: Dict, customer: Dict, billing: Dict) -> str:
         """Extract customer name from various possible structures"""
         if cart.get('customer_name'):
             return cart['customer_name']
-        
-        customer = cart.get('customer', {})
-        if customer:
-            first = customer.get('first_name', '')
-            last = customer.get('last_name', '')
-            name = f"{first} {last}".strip()
-            if name:
-                return name
-        
-        billing = cart.get('billing_address', {})
-        if billing:
-            first = billing.get('first_name', '')
-            last = billing.get('last_name', '')
-            name = f"{first} {last}".strip()
-            if name:
-                return name
-        
-        return 'Unknown Customer'
-    
-    def _get_phone(self, cart: Dict) -> str:
+
+        return full_name(customer) or full_name(billing) or 'Unknown Customer'
+
+    def _get_phone(self, cart: Dict, customer: Dict, billing: Dict, shipping: Dict) -> str:
         """Extract phone from various possible structures"""
         # Direct phone field
         if cart.get('phone'):
             return str(cart['phone'])
-        
+
         # Customer phone
-        customer = cart.get('customer', {})
         if customer.get('phone'):
             return str(customer['phone'])
-        
+
         # Billing address phone
-        billing = cart.get('billing_address', {})
         if billing.get('phone'):
             return str(billing['phone'])
-        
+
         # Shipping address phone
-        shipping = cart.get('shipping_address', {})
         if shipping.get('phone'):
             return str(shipping['phone'])
-        
+
         return ''
-    
-    def _get_address(self, cart: Dict) -> str:
-        """Extract address from cart"""
-        shipping = cart.get('shipping_address', {}) or cart.get('billing_address', {})
-        if not shipping:
+
+    def _get_address(self, address_source: Dict) -> str:
+        """Extract address from the shipping/billing source"""
+        if not address_source:
             return 'No address'
-        
-        parts = [
-            shipping.get('address'),
-            shipping.get('address_2'),
-            shipping.get('city'),
-            shipping.get('state')
-        ]
-        return ', '.join([p for p in parts if p]) or 'No address'
-    
-    def _get_pincode(self, cart: Dict) -> str:
-        """Extract pincode from cart"""
-        shipping = cart.get('shipping_address', {}) or cart.get('billing_address', {})
-        return str(shipping.get('pincode', '') or shipping.get('zip', ''))
-    
-    def _get_product_name(self, cart: Dict) -> str:
-        """Extract first product name from cart"""
-        items = cart.get('line_items', []) or cart.get('products', []) or cart.get('items', [])
-        if items and len(items) > 0:
+
+        return join_address([
+            address_source.get('address'),
+            address_source.get('address_2'),
+            address_source.get('city'),
+            address_source.get('state')
+        ], default='No address')
+
+    def _get_pincode(self, address_source: Dict) -> str:
+        """Extract pincode from the shipping/billing source"""
+        return str(address_source.get('pincode', '') or address_source.get('zip', ''))
+
+    def _get_product_name(self, items: List) -> str:
+        """Extract first product name from the cart's line items"""
+        if items:
             first_item = items[0]
             return first_item.get('name', '') or first_item.get('title', '') or 'Unknown Product'
         return 'Cart Items'
-    
-    def _get_total_qty(self, cart: Dict) -> int:
-        """Calculate total quantity in cart"""
-        items = cart.get('line_items', []) or cart.get('products', []) or cart.get('items', [])
-        total = sum(item.get('quantity', 0) or item.get('qty', 0) for item in items)
-        return total or 1
+
+    def _get_total_qty(self, items: List) -> int:
+        """Calculate total quantity across the cart's line items"""
+        return total_quantity(items, default=1)
 
 
 # Test function
@@ -3,10 +3,46 @@ COD Verification System - Shopify API Integration
 Handles order pulling from 3 Shopify stores
 """
 
+import random
+import re
 import requests
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
+from urllib.parse import urlparse, parse_qs
+
+from order_parsing import join_address, full_name, total_quantity
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Shopify cursor pagination: the next page's URL arrives in the Link
+# response header as <url>; rel="next"
+_NEXT_LINK_RE = re.compile(r'<([^>]+)>;\s*rel="next"')
+
+# COD gateway names ("Cash on Delivery (COD)", "cod", ...) matched in one
+# case-insensitive scan per gateway, without .lower() copies
+_COD_GATEWAY_SEARCH = re.compile(r'cash|cod', re.IGNORECASE).search
+
+# Upper bound on concurrent store fetches, so adding stores can't spawn
+# an unbounded thread burst; within a store, pages are fetched
+# sequentially, which stays inside Shopify's 2-req/s bucket
+_MAX_FETCH_WORKERS = 8
+
+def _decode_json(response):
+    """Decode a response body, preferring orjson's C parser"""
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+# Shared session so keep-alive connections are reused across requests
+# (and across the per-store fetch threads) instead of a new TLS handshake
+# per call
+_session = requests.Session()
+_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=10))
 
 class ShopifyAPI:
     def __init__(self, shop_name, access_token):
@@ -23,29 +59,43 @@ class ShopifyAPI:
             "Content-Type": "application/json"
         }
     
-    def _make_request(self, endpoint, params=None, method='GET'):
-        """Make API request with error handling"""
+    def _make_request(self, endpoint, params=None, method='GET', return_headers=False, retries=3):
+        """Make API request with error handling
+
+        With return_headers=True, returns (body, response headers) so
+        callers can follow Link-header pagination. Rate-limited calls are
+        retried with exponential backoff, honoring Retry-After.
+        """
         url = f"{self.base_url}{endpoint}"
-        
+
         try:
-            if method == 'GET':
-                response = requests.get(url, headers=self.headers, params=params, timeout=30)
-            else:
-                response = requests.post(url, headers=self.headers, json=params, timeout=30)
-            
-            response.raise_for_status()
-            return response.json()
+            for attempt in range(retries):
+                if method == 'GET':
+                    response = _session.get(url, headers=self.headers, params=params, timeout=30)
+                else:
+                    response = _session.post(url, headers=self.headers, json=params, timeout=30)
+
+                if response.status_code == 429 and attempt < retries - 1:
+                    # Honor the server's Retry-After; otherwise back off
+                    # exponentially with jitter so parallel store fetches
+                    # don't re-enter in lockstep
+                    retry_after = response.headers.get('Retry-After')
+                    wait_time = float(retry_after) if retry_after else (2 ** attempt) + random.uniform(0, 1)
+                    print(f"⏳ Shopify rate limited for {self.shop_name}. Waiting {wait_time:.1f}s...")
+                    time.sleep(wait_time)
+                    continue
+
+                response.raise_for_status()
+                if return_headers:
+                    return _decode_json(response), response.headers
+                return _decode_json(response)
         
-        except requests.exceptions.Timeout:
-            print(f"❌ Shopify API Timeout for {self.shop_name}")
-            raise Exception(f"Shopify API timeout for {self.shop_name}")
-        except requests.exceptions.HTTPError as e:
-            print(f"❌ Shopify HTTP Error for {self.shop_name}: {e}")
-            print(f"Response: {e.response.text if e.response else 'No response'}")
-            raise Exception(f"Shopify API error: {e}")
         except requests.exceptions.RequestException as e:
-            print(f"❌ Shopify API Error for {self.shop_name}: {e}")
-            raise Exception(f"Shopify API request failed: {e}")
+            # One error path for timeout/HTTP/connection failures;
+            # re-raise the original so the traceback isn't lost
+            detail = e.response.text if getattr(e, 'response', None) is not None else e
+            print(f"❌ Shopify API error for {self.shop_name}: {detail}")
+            raise
     
     def fetch_cod_orders(self, days=10) -> List[Dict]:
         """
@@ -62,50 +112,46 @@ class ShopifyAPI:
         }
         
         all_orders = []
-        page_info = None
-        
+
         print(f"📥 Fetching COD orders from {self.shop_name} (last {days} days)...")
-        
+
         while True:
-            if page_info:
-                params['page_info'] = page_info
-            
-            result = self._make_request('/orders.json', params=params)
-            
+            result, headers = self._make_request('/orders.json', params=params, return_headers=True)
+
             if not result or 'orders' not in result:
                 break
-            
+
             orders = result['orders']
             if not orders:
                 break
-            
+
             # Filter for COD orders
             cod_orders = [
                 order for order in orders
                 if self._is_cod_order(order)
             ]
-            
+
             all_orders.extend(cod_orders)
-            
-            # Check for next page
-            if len(orders) < 250:
+
+            # Follow the Link header cursor to the next page
+            match = _NEXT_LINK_RE.search(headers.get('Link', ''))
+            if not match:
                 break
-            
-            # Get page_info from Link header (if available)
-            # For simplicity, we'll break after first page for now
-            # TODO: Implement pagination properly
-            break
-        
+            page_info = parse_qs(urlparse(match.group(1)).query).get('page_info')
+            if not page_info:
+                break
+            # Cursor pages reject the original filter params; only limit
+            # and page_info are allowed
+            params = {'limit': 250, 'page_info': page_info[0]}
+
         print(f"✅ Found {len(all_orders)} COD orders from {self.shop_name}")
         return all_orders
     
     def _is_cod_order(self, order) -> bool:
         """Check if an order is Cash on Delivery"""
         # Check payment gateway names
-        if order.get('payment_gateway_names'):
-            for gateway in order['payment_gateway_names']:
-                if 'cash' in gateway.lower() or 'cod' in gateway.lower():
-                    return True
+        if any(_COD_GATEWAY_SEARCH(gateway) for gateway in order.get('payment_gateway_names') or ()):
+            return True
         
         # Check financial status (pending usually means COD)
         if order.get('financial_status') == 'pending':
@@ -150,32 +196,29 @@ class ShopifyAPI:
         
         # Get first line item details
         first_item = line_items[0] if line_items else {}
-        total_qty = sum(item.get('quantity', 0) for item in line_items)
-        
+        total_qty = total_quantity(line_items)
+
         # Use billing if no shipping address
         address_source = shipping if shipping.get('address1') else billing
-        
+
         # Format address
-        address_parts = [
+        address = join_address([
             address_source.get('address1', ''),
             address_source.get('address2', ''),
             address_source.get('city', ''),
             address_source.get('province', '')
-        ]
-        address = ', '.join([p for p in address_parts if p]) or 'No address provided'
-        
+        ])
+
         # Get phone
         phone = (
-            address_source.get('phone') or 
-            customer.get('phone') or 
-            checkout.get('phone') or 
+            address_source.get('phone') or
+            customer.get('phone') or
+            checkout.get('phone') or
             ''
         )
-        
+
         # Get customer name
-        customer_name = f"{customer.get('first_name', '')} {customer.get('last_name', '')}".strip()
-        if not customer_name:
-            customer_name = f"{address_source.get('first_name', '')} {address_source.get('last_name', '')}".strip() or 'Unknown Customer'
+        customer_name = full_name(customer) or full_name(address_source) or 'Unknown Customer'
         
         return {
             'order_id': f"CART-{checkout.get('token', checkout.get('id'))}",
@@ -199,30 +242,29 @@ class ShopifyAPI:
         
         # Get first line item details
         first_item = line_items[0] if line_items else {}
-        
+
         # Calculate total quantity
-        total_qty = sum(item.get('quantity', 0) for item in line_items)
-        
+        total_qty = total_quantity(line_items)
+
         # Format address
-        address_parts = [
+        address = join_address([
             shipping.get('address1', ''),
             shipping.get('address2', ''),
             shipping.get('city', ''),
             shipping.get('province', '')
-        ]
-        address = ', '.join([p for p in address_parts if p]) or 'No address provided'
-        
+        ])
+
         # Get phone (try multiple sources)
         phone = (
-            customer.get('phone') or 
-            shipping.get('phone') or 
-            order.get('phone') or 
+            customer.get('phone') or
+            shipping.get('phone') or
+            order.get('phone') or
             ''
         )
-        
+
         return {
             'order_id': order.get('name'),  # e.g., "#1001"
-            'customer_name': f"{customer.get('first_name', '')} {customer.get('last_name', '')}".strip() or 'Unknown Customer',
+            'customer_name': full_name(customer) or 'Unknown Customer',
             'phone': phone,
             'address': address,
             'pincode': shipping.get('zip', ''),
@@ -232,11 +274,13 @@ class ShopifyAPI:
             'order_date': order.get('created_at')
         }
     
-    def bulk_fetch_orders(self, days=10, exclude_ids: List[str] = None) -> List[Dict]:
+    def bulk_fetch_orders(self, days=10, exclude_ids=None) -> List[Dict]:
         """
         Fetch and parse COD orders, excluding already processed ones
         """
-        exclude_ids = exclude_ids or []
+        # Membership test runs once per fetched order; make it a hash
+        # lookup regardless of what the caller passed
+        exclude_ids = frozenset(exclude_ids or ())
         
         raw_orders = self.fetch_cod_orders(days)
         parsed_orders = []
@@ -269,43 +313,44 @@ class MultiStoreManager:
     
     def fetch_all_stores(self, days=10, exclude_ids: List[str] = None) -> Dict[str, List[Dict]]:
         """
-        Fetch orders from all stores
+        Fetch orders from all stores in parallel
         Returns dict: {store_name: [orders]}
         """
-        all_orders = {}
-        
-        for store_name, api in self.stores.items():
-            orders = api.bulk_fetch_orders(days, exclude_ids)
-            all_orders[store_name] = orders
-            time.sleep(0.5)  # Rate limiting between stores
-        
-        return all_orders
+        # Each store has its own rate limit bucket, so fetching them
+        # concurrently is safe and cuts total time to the slowest store
+        with ThreadPoolExecutor(max_workers=min(len(self.stores), _MAX_FETCH_WORKERS) or 1) as executor:
+            futures = {
+                store_name: executor.submit(api.bulk_fetch_orders, days, exclude_ids)
+                for store_name, api in self.stores.items()
+            }
+            return {store_name: future.result() for store_name, future in futures.items()}
     
     def fetch_abandoned_carts_all_stores(self, days=7, exclude_ids: List[str] = None) -> Dict[str, List[Dict]]:
         """
-        Fetch abandoned checkouts from all stores
+        Fetch abandoned checkouts from all stores in parallel
         Returns dict: {store_name: [checkouts]}
         """
-        all_checkouts = {}
-        exclude_ids = exclude_ids or []
-        
-        for store_name, api in self.stores.items():
-            raw_checkouts = api.fetch_abandoned_checkouts(days)
+        exclude_ids = frozenset(exclude_ids or ())
+
+        def fetch_and_parse(api):
             parsed_checkouts = []
-            
-            for checkout in raw_checkouts:
+            for checkout in api.fetch_abandoned_checkouts(days):
                 parsed = api.parse_checkout(checkout)
-                
+
                 # Skip if already processed
                 if parsed['order_id'] in exclude_ids:
                     continue
-                
+
                 parsed_checkouts.append(parsed)
-            
-            all_checkouts[store_name] = parsed_checkouts
-            time.sleep(0.5)  # Rate limiting
-        
-        return all_checkouts
+            return parsed_checkouts
+
+        # Same reasoning as fetch_all_stores: one rate-limit bucket per store
+        with ThreadPoolExecutor(max_workers=min(len(self.stores), _MAX_FETCH_WORKERS) or 1) as executor:
+            futures = {
+                store_name: executor.submit(fetch_and_parse, api)
+                for store_name, api in self.stores.items()
+            }
+            return {store_name: future.result() for store_name, future in futures.items()}
     
     def fetch_store(self, store_name: str, days=10, exclude_ids: List[str] = None) -> List[Dict]:
         """Fetch orders from a specific store"""
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """Quick test to verify Shopify credentials"""
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import requests
 
@@ -12,22 +13,34 @@ stores = [
     ('Store 3', os.getenv('SHOPIFY_STORE_3_NAME'), os.getenv('SHOPIFY_STORE_3_TOKEN')),
 ]
 
-for name, shop, token in stores:
-    print(f"\n{name}:")
-    print(f"  Shop: {shop}")
-    print(f"  Token: {token[:20]}..." if token else "  Token: MISSING")
-    
+
+def check(store):
+    """Check one store's credentials; returns the report lines so output
+    isn't interleaved across threads"""
+    name, shop, token = store
+    lines = [f"\n{name}:", f"  Shop: {shop}"]
+    lines.append(f"  Token: {token[:20]}..." if token else "  Token: MISSING")
+
     if shop and token:
         # Test API call
         url = f"https://{shop}.myshopify.com/admin/api/2024-01/shop.json"
         headers = {"X-Shopify-Access-Token": token}
-        
+
         try:
             response = requests.get(url, headers=headers, timeout=10)
             if response.status_code == 200:
                 shop_data = response.json()
-                print(f"  ✅ Connected! Shop: {shop_data['shop']['name']}")
+                lines.append(f"  ✅ Connected! Shop: {shop_data['shop']['name']}")
             else:
-                print(f"  ❌ Error {response.status_code}: {response.text[:200]}")
+                lines.append(f"  ❌ Error {response.status_code}: {response.text[:200]}")
         except Exception as e:
-            print(f"  ❌ Connection failed: {e}")
+            lines.append(f"  ❌ Connection failed: {e}")
+
+    return lines
+
+
+# The three checks hit unrelated hosts, so run them concurrently; total
+# wall time is the slowest store instead of the sum
+with ThreadPoolExecutor(max_workers=len(stores)) as executor:
+    for result in executor.map(check, stores):
+        print('\n'.join(result))